@@ -1,9 +1,11 @@
 """Database configuration and session management."""
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 import os
+import sqlite3
 
 #Create database directory if it doesn't exist
 os.makedirs("data", exist_ok=True)
@@ -11,12 +13,36 @@ os.makedirs("data", exist_ok=True)
 #SQLite database URL
 SQLALCHEMY_DATABASE_URL = "sqlite:///./data/reviews.db"
 
-# Create engine with check_same_thread=False for SQLite
+# Create engine with check_same_thread=False for SQLite, pooling connections
+# so requests reuse warm (already PRAGMA-tuned) connections
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
+    connect_args={"check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
+    pool_recycle=3600
 )
 
+# SQLite tuning applied to every new connection: WAL lets readers proceed
+# while /ingest writes, and synchronous=NORMAL drops one fsync per commit
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply performance PRAGMAs to a freshly opened SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
 #Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -33,4 +59,61 @@ def get_db():
 
 def create_tables():
     """Create all tables in the database."""
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist, so add any new ones
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    create_search_index()
+
+# FTS5 index over the searchable review columns, kept in sync with triggers.
+# The trigram tokenizer matches arbitrary substrings, like the ILIKE it replaces.
+FTS_COLUMNS = "review_text, customer_name, business_name"
+FTS_STATEMENTS = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+        {FTS_COLUMNS}, content='reviews', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS reviews_fts_ai AFTER INSERT ON reviews BEGIN
+        INSERT INTO reviews_fts(rowid, {FTS_COLUMNS})
+        VALUES (new.id, new.review_text, new.customer_name, new.business_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS reviews_fts_ad AFTER DELETE ON reviews BEGIN
+        INSERT INTO reviews_fts(reviews_fts, rowid, {FTS_COLUMNS})
+        VALUES ('delete', old.id, old.review_text, old.customer_name, old.business_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS reviews_fts_au AFTER UPDATE ON reviews BEGIN
+        INSERT INTO reviews_fts(reviews_fts, rowid, {FTS_COLUMNS})
+        VALUES ('delete', old.id, old.review_text, old.customer_name, old.business_name);
+        INSERT INTO reviews_fts(rowid, {FTS_COLUMNS})
+        VALUES (new.id, new.review_text, new.customer_name, new.business_name);
+    END""",
+)
+
+def _fts_trigram_available() -> bool:
+    """Check whether the linked SQLite has FTS5 with the trigram tokenizer (3.34+)."""
+    try:
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE probe USING fts5(body, tokenize='trigram')")
+        finally:
+            conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+# Detected once at import; without it searches fall back to ILIKE scans
+FTS_AVAILABLE = _fts_trigram_available()
+
+def create_search_index():
+    """Create the full-text search table and triggers, indexing existing reviews on first creation."""
+    if not FTS_AVAILABLE:
+        return
+    
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reviews_fts'")
+        ).first()
+        for statement in FTS_STATEMENTS:
+            conn.execute(text(statement))
+        if not exists:
+            conn.execute(text("INSERT INTO reviews_fts(reviews_fts) VALUES ('rebuild')"))
\ No newline at end of file
@@ -1,10 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import  logging
 
 from .database import create_tables, get_db
 from .routes import reviews, analytics
 from .schemas import HealthResponse
+from .services.ai import ai_service
 from .services.similarity import similarity_service
 
 #logging
@@ -15,7 +17,8 @@ app =  FastAPI(
     title="Customer Reviews Management API",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 #Add cors 
@@ -42,11 +45,19 @@ async def startup_event():
         db = next(get_db())
         similarity_service.initialize_from_database(db)
         db.close()
+        similarity_service.warmup()
         logger.info("application started successfully")
     except Exception as e:
         logger.error(f"Application startup failed: {e}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled connections and save the similarity index on shutdown."""
+    await ai_service.close()
+    similarity_service.save_index()
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """
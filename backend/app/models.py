@@ -1,13 +1,39 @@
 #SQLAlchemy models for the database.
 
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, Index
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.sql import func, table, column
+import orjson
 from .database import Base
 
+class JSONList(TypeDecorator):
+    """List of strings stored as a JSON array in a Text column."""
+    
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return orjson.dumps(value or []).decode()
+    
+    def process_result_value(self, value, dialect):
+        if not value:
+            return []
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            return []  # Skip invalid topic data
+
 class Review(Base):
     """Review model representing customer reviews."""
     
     __tablename__ = "reviews"
+    __table_args__ = (
+        # Serve the /reviews filters and created_at ordering straight from the index
+        Index('ix_reviews_loc_sent_created', 'location', 'sentiment', 'created_at'),
+        Index('ix_reviews_loc_created', 'location', 'created_at'),
+        Index('ix_reviews_sent_created', 'sentiment', 'created_at'),
+        Index('ix_reviews_created_at', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     business_name = Column(String(255), nullable=False, index=True)
@@ -18,8 +44,12 @@ class Review(Base):
     date = Column(String(50), nullable=False)
     sentiment = Column(String(50), nullable=True, index=True)
     sentiment_score = Column(Float, nullable=True)
-    topics = Column(Text, nullable=True)  # JSON string of topics
+    topics = Column(JSONList, nullable=True)  # Stored as a JSON array of topics
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     def __repr__(self):
-        return f"<Review(id={self.id}, business='{self.business_name}', rating={self.rating})>"
\ No newline at end of file
+        return f"<Review(id={self.id}, business='{self.business_name}', rating={self.rating})>"
+
+# Lightweight handle on the FTS5 table created in database.create_search_index;
+# not part of Base.metadata so create_all leaves it alone.
+reviews_fts = table("reviews_fts", column("rowid"), column("reviews_fts"))
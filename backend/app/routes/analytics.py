@@ -1,9 +1,8 @@
 # analytics.py
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from collections import defaultdict
-import json
+from sqlalchemy import func, text
+from collections import Counter
 
 from ..database import get_db
 from ..models import Review as ReviewModel
@@ -11,8 +10,15 @@ from ..schemas import AnalyticsData
 
 router = APIRouter()
 
+# Last analytics result and the (row count, max id) signature it was computed for
+_CACHE = {"entry": None}
+
+def invalidate_analytics_cache():
+    """Drop the cached analytics so the next request recomputes them."""
+    _CACHE["entry"] = None
+
 @router.get("/analytics", response_model=AnalyticsData)
-async def get_analytics(db: Session = Depends(get_db)):
+def get_analytics(db: Session = Depends(get_db)):
     """
     Get analytics data including sentiment counts, topics, ratings, and location stats.
     
@@ -23,51 +29,52 @@ async def get_analytics(db: Session = Depends(get_db)):
         Analytics data with various counts and distributions
     """
     try:
-        # Get all reviews for analysis
-        reviews = db.query(ReviewModel).all()
+        # Serve the cached result while the reviews table is unchanged
+        signature = tuple(db.execute(text("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM reviews")).one())
+        entry = _CACHE["entry"]
+        if entry is not None and entry[0] == signature:
+            return entry[1]
         
-        if not reviews:
-            return AnalyticsData(
-                sentiment_counts={},
-                topic_counts={},
-                rating_distribution={},
-                location_stats={}
-            )
+        # Let SQLite do the counting so only one row per distinct key comes back
+        sentiment_counts = {
+            sentiment: count
+            for sentiment, count in db.query(ReviewModel.sentiment, func.count())
+            .filter(ReviewModel.sentiment.isnot(None))
+            .group_by(ReviewModel.sentiment)
+            .all()
+            if sentiment
+        }
+        rating_distribution = {
+            str(rating): count
+            for rating, count in db.query(ReviewModel.rating, func.count())
+            .group_by(ReviewModel.rating)
+            .all()
+        }
+        location_stats = {
+            location: count
+            for location, count in db.query(ReviewModel.location, func.count())
+            .group_by(ReviewModel.location)
+            .all()
+        }
         
-        # Initialize counters
-        sentiment_counts = defaultdict(int)
-        topic_counts = defaultdict(int)
-        rating_distribution = defaultdict(int)
-        location_stats = defaultdict(int)
-        
-        # Process each review
-        for review in reviews:
-            # Count sentiments
-            if review.sentiment:
-                sentiment_counts[review.sentiment] += 1
-            
-            # Count ratings
-            rating_distribution[str(review.rating)] += 1
-            
-            # Count locations
-            location_stats[review.location] += 1
-            
-            # Count topics
-            if review.topics:
-                try:
-                    topics = json.loads(review.topics)
-                    for topic in topics:
-                        topic_counts[topic] += 1
-                except (json.JSONDecodeError, TypeError):
-                    pass  # Skip invalid topic data
+        # Topics are stored as JSON lists, so only that column is streamed and counted here
+        topic_counts = Counter()
+        topic_rows = (
+            db.query(ReviewModel.topics)
+            .filter(ReviewModel.topics.isnot(None))
+            .yield_per(1000)
+        )
+        for (topics,) in topic_rows:
+            topic_counts.update(topics)
         
-        # Convert defaultdicts to regular dicts
-        return AnalyticsData(
-            sentiment_counts=dict(sentiment_counts),
+        analytics = AnalyticsData(
+            sentiment_counts=sentiment_counts,
             topic_counts=dict(topic_counts),
-            rating_distribution=dict(rating_distribution),
-            location_stats=dict(location_stats)
+            rating_distribution=rating_distribution,
+            location_stats=location_stats
         )
+        _CACHE["entry"] = (signature, analytics)
+        return analytics
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch analytics: {str(e)}")
\ No newline at end of file
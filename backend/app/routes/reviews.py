@@ -1,64 +1,104 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from typing import List, Optional
-import json
-import math
+from sqlalchemy import and_, or_, case, func, insert, literal, select, true, tuple_
+from typing import List, Optional, Tuple
+from functools import lru_cache
 
-from ..database import get_db
-from ..models import Review as ReviewModel
+from ..database import FTS_AVAILABLE, get_db
+from ..models import Review as ReviewModel, reviews_fts
 from ..schemas import (
     Review, ReviewCreate, ReviewFilters, ReviewsResponse, 
     IngestResponse, SuggestedReply, SimilarReviewsResponse
 )
 from ..services.ai import ai_service
 from ..services.similarity import similarity_service
+from .analytics import invalidate_analytics_cache
 
 router = APIRouter()
 
+# Shortest search term the trigram full-text index can match
+FTS_MIN_QUERY_LENGTH = 3
+
+# Columns of the Review response schema, selected as plain rows for list responses
+# so neither ORM objects nor per-row Pydantic models are built
+REVIEW_COLUMNS = (
+    ReviewModel.id,
+    ReviewModel.business_name,
+    ReviewModel.location,
+    ReviewModel.customer_name,
+    ReviewModel.rating,
+    ReviewModel.review_text,
+    ReviewModel.date,
+    ReviewModel.sentiment,
+    ReviewModel.sentiment_score,
+    ReviewModel.topics,
+    ReviewModel.created_at,
+)
+
+@lru_cache(maxsize=1024)
+def _cached_similar(q: str, k: int, version: int) -> Tuple[Tuple[int, float], ...]:
+    """
+    Cached similarity lookup.
+    
+    The index version is part of the key, so entries computed against an
+    older index are never returned once reviews are added.
+    """
+    return tuple(similarity_service.find_similar(q, k))
+
 @router.post("/ingest", response_model=IngestResponse)
-async def ingest_reviews(reviews: List[ReviewCreate], db: Session = Depends(get_db)):
+def ingest_reviews(reviews: List[ReviewCreate], db: Session = Depends(get_db)):
     """
     Ingest a batch of reviews into the database.
     """
+    if not reviews:
+        # An insert with no parameter sets would run as one defaults-only insert
+        return IngestResponse(message="Successfully ingested 0 reviews", count=0)
+    
     try:
-        processed_reviews = []
+        # Run the AI analysis up front so the database work is a single batch
+        texts = [review_data.review_text for review_data in reviews]
+        sentiments = ai_service.analyze_sentiments(texts)
+        topics = [ai_service.extract_topics(text) for text in texts]
         
-        for review_data in reviews:
-            # Analyze sentiment and extract topics
-            sentiment, sentiment_score = ai_service.analyze_sentiment(review_data.review_text)
-            topics = ai_service.extract_topics(review_data.review_text)
-            
-            # Create review model instance
-            db_review = ReviewModel(
-                business_name=review_data.business_name,
-                location=review_data.location,
-                customer_name=review_data.customer_name,
-                rating=review_data.rating,
-                review_text=review_data.review_text,
-                date=review_data.date,
-                sentiment=sentiment,
-                sentiment_score=sentiment_score,
-                topics=json.dumps(topics)  # Store as JSON string
-            )
-            
-            processed_reviews.append(db_review)
+        payload = [
+            {
+                "business_name": review_data.business_name,
+                "location": review_data.location,
+                "customer_name": review_data.customer_name,
+                "rating": review_data.rating,
+                "review_text": review_data.review_text,
+                "date": review_data.date,
+                "sentiment": sentiment,
+                "sentiment_score": sentiment_score,
+                "topics": review_topics
+            }
+            for review_data, (sentiment, sentiment_score), review_topics
+            in zip(reviews, sentiments, topics)
+        ]
         
-        #Add all reviews to database
-        db.add_all(processed_reviews)
+        #Insert all reviews in one transaction, getting the new ids back in order
+        new_ids = db.scalars(
+            insert(ReviewModel).returning(ReviewModel.id, sort_by_parameter_order=True),
+            payload
+        ).all()
         db.commit()
+        invalidate_analytics_cache()
         
-        #Rebuild similarity index with new  data
-        all_reviews =db.query(ReviewModel).all()
-        reviews_for_index = [
-            {'id': r.id, 'review_text': r.review_text} 
-            for r in all_reviews
-        ]
-        similarity_service.build_index(reviews_for_index)
+        #Append only the new reviews to the similarity index
+        try:
+            similarity_service.add_documents([
+                {'id': review_id, 'review_text': row['review_text']}
+                for review_id, row in zip(new_ids, payload)
+            ])
+        except Exception:
+            # The reviews are committed, so resync the index from the database
+            similarity_service.initialize_from_database(db)
         
         return IngestResponse(
-            message=f"Successfully ingested {len(processed_reviews)} reviews",
-            count=len(processed_reviews)
+            message=f"Successfully ingested {len(payload)} reviews",
+            count=len(payload)
         )
         
     except Exception as e:
@@ -66,40 +106,53 @@ async def ingest_reviews(reviews: List[ReviewCreate], db: Session = Depends(get_
         raise HTTPException(status_code=500, detail=f"Failed to ingest reviews: {str(e)}")
 
 @router.get("/reviews", response_model=ReviewsResponse)
-async def get_reviews(
+def get_reviews(
     location: Optional[str] = Query(None, description="Filter by location"),
     sentiment: Optional[str] = Query(None, description="Filter by sentiment"),
     search: Optional[str] = Query(None, description="Search in review text"),
     page: int = Query(1, ge=1, description="Page number"),
     limit: int = Query(10, ge=1, le=100, description="Items per page"),
+    exact_total: bool = Query(True, description="Count all matching reviews to fill in total and pages"),
+    after_id: Optional[int] = Query(None, description="Cursor: return reviews after this review id, ignoring page"),
     db: Session = Depends(get_db)
 ):
     """
     Get reviews with filtering and pagination.
     
+    Counting every matching review costs a scan of the whole result set, so
+    large listings can pass exact_total=false and page with has_next and
+    after_id (the id of the last review received) instead.
+    
     Args:
         location: Optional location filter
         sentiment: Optional sentiment filter
         search: Optional text search
         page: Page number (1-based)
         limit: Number of items per page
+        exact_total: Whether to compute total and pages
+        after_id: Optional keyset cursor, the last review id of the previous page
         db: Database session
         
     Returns:
         Paginated reviews response
     """
     try:
-        #Build query with filters
-        query = db.query(ReviewModel)
-        
         #Apply filters
         filters = []
         if location:
             filters.append(ReviewModel.location == location)
         if sentiment:
             filters.append(ReviewModel.sentiment == sentiment)
-        if search:
-            # Search across multiple fields: review text, customer name, and business name
+        if search and FTS_AVAILABLE and len(search) >= FTS_MIN_QUERY_LENGTH:
+            # Search review text, customer name, and business name through the FTS index,
+            # quoting the term as a phrase so it is matched literally
+            phrase = '"' + search.replace('"', '""') + '"'
+            matching_ids = select(reviews_fts.c.rowid).where(
+                reviews_fts.c.reviews_fts.op("MATCH")(phrase)
+            )
+            filters.append(ReviewModel.id.in_(matching_ids))
+        elif search:
+            # No FTS5 support, or a term too short for the trigram index: scan instead
             search_filter = or_(
                 ReviewModel.review_text.ilike(f"%{search}%"),
                 ReviewModel.customer_name.ilike(f"%{search}%"),
@@ -107,49 +160,50 @@ async def get_reviews(
             )
             filters.append(search_filter)
         
-        if filters:
-            query = query.filter(and_(*filters))
+        where = and_(*filters) if filters else true()
         
-        #Get total count
-        total = query.count()
+        #Get total count only when asked for
+        total = pages = None
+        if exact_total:
+            total = db.scalar(select(func.count()).select_from(ReviewModel).where(where))
+            pages = (total + limit - 1) // limit if total > 0 else 1
         
-        #Apply pagination
-        offset = (page - 1) * limit
-        reviews = query.order_by(ReviewModel.created_at.desc()).offset(offset).limit(limit).all()
-        
-        #Convert to response format
-        review_responses = []
-        for review in reviews:
-            topics = json.loads(review.topics) if review.topics else [] # type: ignore
-            review_dict = {
-                "id": review.id,
-                "business_name": review.business_name,
-                "location": review.location,
-                "customer_name": review.customer_name,
-                "rating": review.rating,
-                "review_text": review.review_text,
-                "date": review.date,
-                "sentiment": review.sentiment,
-                "sentiment_score": review.sentiment_score,
-                "topics": topics,
-                "created_at": review.created_at
-            }
-            review_responses.append(Review(**review_dict))
-        
-        pages = math.ceil(total / limit) if total > 0 else 1
-        
-        return ReviewsResponse(
-            reviews=review_responses,
-            total=total,
-            page=page,
-            pages=pages
+        #Apply pagination, selecting plain rows (topics already decoded by the column type).
+        #One extra row is fetched to tell whether another page follows.
+        query = (
+            select(*REVIEW_COLUMNS)
+            .where(where)
+            .order_by(ReviewModel.created_at.desc(), ReviewModel.id.desc())
         )
+        if after_id is not None:
+            # Seek past the cursor review on the full sort key. Its created_at is read
+            # in SQL so the stored value is compared as-is, and an unknown id yields no rows.
+            cursor_created_at = (
+                select(ReviewModel.created_at)
+                .where(ReviewModel.id == after_id)
+                .scalar_subquery()
+            )
+            query = query.where(
+                tuple_(ReviewModel.created_at, ReviewModel.id) < tuple_(cursor_created_at, literal(after_id))
+            )
+        else:
+            query = query.offset((page - 1) * limit)
+        reviews = db.execute(query.limit(limit + 1)).mappings().all()
+        
+        #Rows already match the Review schema, so serialize them directly with orjson
+        return ORJSONResponse(content={
+            "reviews": [dict(review) for review in reviews[:limit]],
+            "total": total,
+            "page": page,
+            "pages": pages,
+            "has_next": len(reviews) > limit
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch reviews: {str(e)}")
 
 @router.get("/reviews/{review_id}", response_model=Review)
-async def get_review(review_id: int, db: Session = Depends(get_db)):
+def get_review(review_id: int, db: Session = Depends(get_db)):
     """
     Get a single review by ID.
     
@@ -165,23 +219,7 @@ async def get_review(review_id: int, db: Session = Depends(get_db)):
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
     
-    topics = json.loads(review.topics) if review.topics else [] # type: ignore
-    
-    review_dict = {
-        "id": review.id,
-        "business_name": review.business_name,
-        "location": review.location,
-        "customer_name": review.customer_name,
-        "rating": review.rating,
-        "review_text": review.review_text,
-        "date": review.date,
-        "sentiment": review.sentiment,
-        "sentiment_score": review.sentiment_score,
-        "topics": topics,
-        "created_at": review.created_at
-    }
-    
-    return Review(**review_dict)
+    return Review.model_validate(review)
 
 @router.post("/reviews/{review_id}/suggest-reply", response_model=SuggestedReply)
 async def suggest_reply(review_id: int, db: Session = Depends(get_db)):
@@ -195,14 +233,17 @@ async def suggest_reply(review_id: int, db: Session = Depends(get_db)):
     Returns:
         Suggested reply with metadata
     """
-    review = db.query(ReviewModel).filter(ReviewModel.id == review_id).first()
+    # The query blocks, so it runs in the threadpool rather than on the event loop
+    review = await run_in_threadpool(
+        lambda: db.query(ReviewModel).filter(ReviewModel.id == review_id).first()
+    )
     
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
     
     try:
         # Generate reply suggestion using AI service
-        suggestion = ai_service.suggest_reply(
+        suggestion = await ai_service.suggest_reply(
             review.review_text, # type: ignore
             review.rating, # type: ignore
             review.sentiment or 'neutral' # type: ignore
@@ -214,7 +255,7 @@ async def suggest_reply(review_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Failed to generate reply: {str(e)}")
 
 @router.get("/search", response_model=SimilarReviewsResponse)
-async def search_similar_reviews(
+def search_similar_reviews(
     q: str = Query(..., description="Search query"),
     k: int = Query(5, ge=1, le=20, description="Number of similar reviews to return"),
     db: Session = Depends(get_db)
@@ -224,58 +265,47 @@ async def search_similar_reviews(
     """
     try:
         # Find similar review IDs using similarity service
-        similar_ids_scores = similarity_service.find_similar(q, k)
+        similar_ids_scores = _cached_similar(q, k, similarity_service.version)
         
         if not similar_ids_scores:
             return SimilarReviewsResponse(similar_reviews=[], query=q)
         
-        # Get review IDs
+        # Get review IDs and their similarity rank
         review_ids = [item[0] for item in similar_ids_scores]
+        ranking = case(
+            {review_id: rank for rank, review_id in enumerate(review_ids)},
+            value=ReviewModel.id
+        )
         
-        # Fetch reviews from database
-        reviews = db.query(ReviewModel).filter(ReviewModel.id.in_(review_ids)).all()
-        
-        # Sort by similarity score and convert to response format
-        id_to_review = {r.id: r for r in reviews}
-        sorted_reviews = []
-        
-        for review_id, score in similar_ids_scores:
-            if review_id in id_to_review:
-                review = id_to_review[review_id] # type: ignore
-                topics = json.loads(review.topics) if review.topics else [] # type: ignore
-                
-                review_dict = {
-                    "id": review.id,
-                    "business_name": review.business_name,
-                    "location": review.location,
-                    "customer_name": review.customer_name,
-                    "rating": review.rating,
-                    "review_text": review.review_text,
-                    "date": review.date,
-                    "sentiment": review.sentiment,
-                    "sentiment_score": review.sentiment_score,
-                    "topics": topics,
-                    "created_at": review.created_at
-                }
-                sorted_reviews.append(Review(**review_dict))
+        # Fetch just the response columns as plain rows, already ordered by similarity
+        reviews = db.execute(
+            select(*REVIEW_COLUMNS)
+            .where(ReviewModel.id.in_(review_ids))
+            .order_by(ranking)
+        ).mappings().all()
         
-        return SimilarReviewsResponse(similar_reviews=sorted_reviews, query=q)
+        return ORJSONResponse(content={
+            "similar_reviews": [dict(review) for review in reviews],
+            "query": q
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 @router.get("/locations")
-async def get_locations(db: Session = Depends(get_db)):
+def get_locations(db: Session = Depends(get_db)):
     """
     Get all unique locations from reviews.
     """
     try:
-        # Query for distinct locations
-        locations = db.query(ReviewModel.location).distinct().all()
-        # Extract location strings and filter out None values
-        unique_locations = [loc[0] for loc in locations if loc[0]]
-        # Sort alphabetically
-        unique_locations.sort()
-        return {"locations": unique_locations}
+        # Distinct, non-empty locations in alphabetical order, served from the location index
+        locations = (
+            db.query(ReviewModel.location)
+            .filter(ReviewModel.location.isnot(None), ReviewModel.location != "")
+            .distinct()
+            .order_by(ReviewModel.location)
+            .all()
+        )
+        return {"locations": [loc[0] for loc in locations]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch locations: {str(e)}")
\ No newline at end of file
@@ -1,6 +1,6 @@
 #schemas for request/response validation. 
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
@@ -18,14 +18,13 @@ class ReviewCreate(ReviewBase):
 
 class Review(ReviewBase):
     """Complete review schema with all fields."""
+    model_config = ConfigDict(from_attributes=True)
+    
     id: int
     sentiment: Optional[str] = None
     sentiment_score: Optional[float] = None
     topics: Optional[List[str]] = None
     created_at: datetime
-    
-    class Config:
-        from_attributes = True
 
 class ReviewFilters(BaseModel):
     """Schema for filtering reviews."""
@@ -38,9 +37,10 @@ class ReviewFilters(BaseModel):
 class ReviewsResponse(BaseModel):
     """Schema for paginated reviews response."""
     reviews: List[Review]
-    total: int
+    total: Optional[int] = None  # None when exact_total=false
     page: int
-    pages: int
+    pages: Optional[int] = None  # None when exact_total=false
+    has_next: bool = False
 
 class IngestResponse(BaseModel):
     message: str
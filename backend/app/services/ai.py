@@ -1,14 +1,33 @@
 """AI services for sentiment analysis and reply generation."""
 
-from transformers import pipeline, AutoTokenizer
+from transformers import pipeline, AutoConfig, AutoTokenizer
 import logging
-from typing import List, Dict, Tuple
-import json
-import requests
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, NamedTuple, Tuple
+import asyncio
+import contextlib
+import httpx
 import os
+import random
+import re
 from dotenv import load_dotenv
 from pathlib import Path
 
+try:
+    import ahocorasick
+except ImportError:  # keyword matching falls back to one substring scan per keyword
+    ahocorasick = None
+
+try:
+    import torch
+except ImportError:  # transformers needs torch for inference; without it the fallback is used
+    torch = None
+
+# Model calls run without autograd bookkeeping
+_inference_mode = torch.inference_mode if torch is not None else contextlib.nullcontext
+
 # Load environment variables from .env file in backend directory
 backend_dir = Path(__file__).parent.parent.parent
 env_file = backend_dir / '.env'
@@ -18,30 +37,258 @@ load_dotenv(env_file)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Longest input, in tokens, passed to the sentiment model
+MAX_SEQUENCE_LENGTH = 128
+
+# Distilled 6-layer model by default; override with SENTIMENT_MODEL
+DEFAULT_SENTIMENT_MODEL = "distilbert-base-uncased-finetuned-sst-2-english"
+# ONNX exports for SENTIMENT_RUNTIME=onnx/onnx-int8, kept so later starts skip the export
+ONNX_CACHE_DIR = os.getenv('SENTIMENT_ONNX_DIR', 'data/onnx')
+# Word lists for the keyword fallback when the sentiment model is unavailable;
+# matched as whole words, so common inflections are listed explicitly
+FALLBACK_POSITIVE_WORDS = frozenset({
+    'good', 'great', 'excellent', 'amazing', 'love', 'loved', 'loves', 'best', 'wonderful'
+})
+FALLBACK_NEGATIVE_WORDS = frozenset({
+    'bad', 'terrible', 'awful', 'hate', 'hated', 'hates', 'worst', 'horrible', 'disappointed'
+})
+_WORD_RE = re.compile(r"[a-z]+")
+
+# Reply requests share one keep-alive connection pool instead of a new TLS handshake per call
+REPLY_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+REPLY_HTTP_TIMEOUT = 30
+# Rate-limited and gateway responses are retried with backoff before falling back to a template
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+REPLY_MAX_ATTEMPTS = 4
+REPLY_RETRY_INITIAL_WAIT = 0.5
+REPLY_RETRY_MAX_WAIT = 10
+
+# Static parts of the reply prompt; generate_ai_reply only formats the review-specific middle
+_PROMPT_PREFIX = "You are a professional restaurant manager responding to a customer review.\n"
+_PROMPT_SUFFIX = """
+
+Guidelines:
+- Keep the response under 150 words
+- Be genuine and specific to the review
+- If it's a positive review, express gratitude
+- If it's a negative review, acknowledge concerns and offer solutions
+- Maintain a professional but warm tone
+- Don't make promises you can't keep
+
+Response:"""
+
+# Two-class models have no neutral label, so low-confidence predictions are treated as neutral
+NEUTRAL_THRESHOLD = 0.75
+
+# Review streams repeat a lot (templated reviews, re-ingests), so model and keyword
+# results are cached per distinct text
+ANALYSIS_CACHE_SIZE = 10000
+
+TOPIC_KEYWORDS = {
+    'food quality': ['taste', 'flavor', 'delicious', 'fresh', 'quality', 'food'],
+    'service': ['service', 'staff', 'waiter', 'waitress', 'server', 'friendly', 'rude'],
+    'atmosphere': ['atmosphere', 'ambiance', 'music', 'noise', 'crowded', 'quiet'],
+    'price': ['price', 'cost', 'expensive', 'cheap', 'value', 'money'],
+    'delivery': ['delivery', 'arrived', 'late', 'fast', 'quick', 'slow'],
+    'cleanliness': ['clean', 'dirty', 'hygiene', 'mess', 'tidy'],
+    'location': ['location', 'parking', 'access', 'convenient', 'far'],
+    'wait time': ['wait', 'waiting', 'long', 'quick', 'fast', 'slow']
+}
+
+# Common issues to address in replies
+ISSUE_KEYWORDS = {
+    'Thank customer for feedback': ['review', 'feedback'],
+    'Address food quality concerns': ['food', 'taste', 'cold', 'hot'],
+    'Acknowledge service issues': ['service', 'staff', 'waiter', 'slow'],
+    'Apologize for wait time': ['wait', 'long', 'slow', 'late'],
+    'Address cleanliness concerns': ['clean', 'dirty', 'mess'],
+    'Acknowledge pricing feedback': ['expensive', 'price', 'cost', 'value']
+}
+
+def _build_keyword_automaton(keyword_groups: Dict[str, List[str]]):
+    """Build an Aho-Corasick automaton mapping each keyword to the groups that list it."""
+    if ahocorasick is None:
+        return None
+    
+    owners = {}
+    for group, keywords in keyword_groups.items():
+        for keyword in keywords:
+            owners.setdefault(keyword, []).append(group)
+    
+    automaton = ahocorasick.Automaton()
+    for keyword, groups in owners.items():
+        automaton.add_word(keyword, tuple(groups))
+    automaton.make_automaton()
+    return automaton
+
+def _match_keyword_groups(text_lower: str, keyword_groups: Dict[str, List[str]], automaton) -> List[str]:
+    """
+    Return the groups with a keyword occurring anywhere in text_lower, in
+    keyword_groups order. With an automaton this is one pass over the text.
+    """
+    if automaton is None:
+        return [
+            group for group, keywords in keyword_groups.items()
+            if any(keyword in text_lower for keyword in keywords)
+        ]
+    
+    found = set()
+    for _, groups in automaton.iter(text_lower):
+        found.update(groups)
+    return [group for group in keyword_groups if group in found]
+
+# Topic and reply key-point keywords share one automaton, keyed by (kind, group)
+_FEATURE_KEYWORDS = {
+    **{('topic', topic): keywords for topic, keywords in TOPIC_KEYWORDS.items()},
+    **{('issue', point): keywords for point, keywords in ISSUE_KEYWORDS.items()}
+}
+_FEATURE_AUTOMATON = _build_keyword_automaton(_FEATURE_KEYWORDS)
+
+class _TextFeatures(NamedTuple):
+    """Keyword features of one review text."""
+    topics: Tuple[str, ...]
+    key_points: Tuple[str, ...]
+    positive_words: int
+    negative_words: int
+
+@lru_cache(maxsize=ANALYSIS_CACHE_SIZE)
+def _analyze_features(text_lower: str) -> _TextFeatures:
+    """
+    Topics, reply key points and fallback sentiment word counts for
+    lowercased text, from one keyword scan and one tokenization; cached per
+    distinct text.
+    """
+    groups = _match_keyword_groups(text_lower, _FEATURE_KEYWORDS, _FEATURE_AUTOMATON)
+    tokens = set(_WORD_RE.findall(text_lower))
+    
+    return _TextFeatures(
+        topics=tuple(group for kind, group in groups if kind == 'topic')[:3],  #Return max 3 topics
+        key_points=tuple(group for kind, group in groups if kind == 'issue'),
+        positive_words=len(tokens & FALLBACK_POSITIVE_WORDS),
+        negative_words=len(tokens & FALLBACK_NEGATIVE_WORDS)
+    )
+
 class AIService:
     """Service class for AI-powered features."""
     
     def __init__(self):
         """Initialize AI models."""
+        # LRU cache of model sentiment results keyed on the stripped review text
+        self._sentiment_cache = OrderedDict()
+        self._sentiment_cache_lock = threading.Lock()
+        # Pooled client for Perplexity reply requests, created by _get_http_client
+        # on first use and again after close()
+        self._http = None
+        
+        #AI API configuration
+        self.perplexity_api_key = os.getenv('PERPLEXITY_API_KEY')
+        self.perplexity_endpoint = "https://api.perplexity.ai/chat/completions"
+        
+        # The sentiment model is loaded on first use by _get_sentiment_analyzer,
+        # so importing this module doesn't download or load any weights
+        self.sentiment_analyzer = None
+        self.neutral_threshold = None
+        self._model_load_attempted = False
+        self._model_load_lock = threading.Lock()
+    
+    def _get_sentiment_analyzer(self):
+        """Return the sentiment pipeline, loading it on the first call; None if it can't be loaded."""
+        if self.sentiment_analyzer is None and not self._model_load_attempted:
+            with self._model_load_lock:
+                if self.sentiment_analyzer is None and not self._model_load_attempted:
+                    self._load_sentiment_model()
+                    self._model_load_attempted = True
+        return self.sentiment_analyzer
+    
+    def _load_sentiment_model(self):
+        """Load the sentiment analysis pipeline, leaving it None on failure so the fallback is used."""
         try:
-            #Sentiment analysis pipeline
-            self.sentiment_analyzer = pipeline(
+            #Sentiment analysis pipeline, in half precision on GPU
+            model_name = os.getenv('SENTIMENT_MODEL', DEFAULT_SENTIMENT_MODEL)
+            device = -1
+            model_kwargs = {}
+            if torch is not None:
+                # Share the cores between server worker processes instead of each
+                # worker starting one intra-op thread per core
+                workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+                torch.set_num_threads(max(1, (os.cpu_count() or 1) // max(1, workers)))
+                if torch.cuda.is_available():
+                    device = 0
+                    model_kwargs["torch_dtype"] = (
+                        torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+                    )
+            model = model_name
+            runtime = os.getenv('SENTIMENT_RUNTIME', '').lower()
+            if device == -1 and runtime in ('onnx', 'onnx-int8'):
+                model = self._load_onnx_model(model_name, quantize=runtime == 'onnx-int8') or model_name
+            analyzer = pipeline(
                 "sentiment-analysis", # type: ignore
-                model="cardiffnlp/twitter-roberta-base-sentiment-latest",
-                tokenizer="cardiffnlp/twitter-roberta-base-sentiment-latest"
+                model=model,
+                tokenizer=model_name,
+                device=device,
+                model_kwargs=model_kwargs
             ) # type: ignore
             
-            #AI API configuration
-            self.perplexity_api_key = os.getenv('PERPLEXITY_API_KEY')
-            self.perplexity_endpoint = "https://api.perplexity.ai/chat/completions"
+            labels = {label.lower() for label in analyzer.model.config.id2label.values()}
+            self.neutral_threshold = None if 'neutral' in labels else NEUTRAL_THRESHOLD
+            self.sentiment_analyzer = analyzer
             
             logger.info("AI models loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load AI models: {e}")
             # Fallback to None if models can't be loaded
             self.sentiment_analyzer = None
-            self.perplexity_api_key = None
-            self.perplexity_endpoint = None
+            self.neutral_threshold = None
+    
+    def _load_onnx_model(self, model_name: str, quantize: bool = False):
+        """
+        Load the model on ONNX Runtime's CPU provider from an export cached
+        under ONNX_CACHE_DIR, exporting (and with quantize, int8-quantizing)
+        it on the first run only.
+        
+        Opt-in with SENTIMENT_RUNTIME=onnx or onnx-int8. Returns None, so the
+        PyTorch model is used instead, if optimum[onnxruntime] isn't installed
+        or the export fails.
+        """
+        try:
+            from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        except ImportError:
+            logger.warning("SENTIMENT_RUNTIME=onnx needs optimum[onnxruntime]; using PyTorch")
+            return None
+        
+        export_dir = os.path.join(ONNX_CACHE_DIR, model_name.replace('/', '--'))
+        try:
+            if not os.path.exists(os.path.join(export_dir, 'model.onnx')):
+                exported = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+                exported.save_pretrained(export_dir)
+                logger.info(f"Exported {model_name} to ONNX in {export_dir}")
+            
+            if not quantize:
+                return ORTModelForSequenceClassification.from_pretrained(
+                    export_dir,
+                    provider="CPUExecutionProvider"
+                )
+            
+            # Dynamic int8 quantization: weights quantized ahead of time, activations at run time
+            quantized_dir = export_dir + '-int8'
+            if not os.path.exists(os.path.join(quantized_dir, 'model_quantized.onnx')):
+                quantizer = ORTQuantizer.from_pretrained(export_dir)
+                quantizer.quantize(
+                    save_dir=quantized_dir,
+                    quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+                )
+                AutoConfig.from_pretrained(export_dir).save_pretrained(quantized_dir)
+                logger.info(f"Quantized the ONNX export of {model_name} to int8 in {quantized_dir}")
+            
+            return ORTModelForSequenceClassification.from_pretrained(
+                quantized_dir,
+                file_name='model_quantized.onnx',
+                provider="CPUExecutionProvider"
+            )
+        except Exception as e:
+            logger.error(f"ONNX export of {model_name} failed, using PyTorch: {e}")
+            return None
     
     def analyze_sentiment(self, text: str) -> Tuple[str, float]:
         """
@@ -53,50 +300,136 @@ class AIService:
         Returns:
             Tuple of (sentiment_label, confidence_score)
         """
-        if not self.sentiment_analyzer:
+        if not text or text.isspace():
+            return 'neutral', 0.0
+        
+        analyzer = self._get_sentiment_analyzer()
+        if not analyzer:
             # Fallback sentiment analysis
             return self._fallback_sentiment(text)
         
+        key = text.strip()
+        cached = self._get_cached_sentiment(key)
+        if cached is not None:
+            return cached
+        
         try:
-            #Truncate text if too long
-            text = text[:500]
-            
-            result = self.sentiment_analyzer(text)[0]
-            label = result['label'].lower()
-            score = result['score']
+            #Truncate at the tokenizer so the model sees at most MAX_SEQUENCE_LENGTH tokens
+            with _inference_mode():
+                result = analyzer(key, truncation=True, max_length=MAX_SEQUENCE_LENGTH)[0]
+            sentiment = self._map_sentiment_result(result)
+            self._cache_sentiment(key, sentiment)
+            return sentiment
             
-            #Map labels to consistent format
-            label_mapping = {
-                'positive': 'positive',
-                'negative': 'negative',
-                'neutral': 'neutral'
-            }
+        except Exception as e:
+            logger.error(f"Sentiment analysis failed: {e}")
+            return self._fallback_sentiment(text)
+    
+    def analyze_sentiments(self, texts: List[str], batch_size: int = 32) -> List[Tuple[str, float]]:
+        """
+        Analyze sentiment of many review texts in batched model calls.
+        
+        Cached texts are answered without the model; the rest are deduplicated
+        and sorted by length before batching so each batch pads to a similar
+        length. Results are returned in the original order.
+        
+        Args:
+            texts: Review texts to analyze
+            batch_size: Number of texts per model forward pass
             
-            mapped_label = label_mapping.get(label, 'neutral')
+        Returns:
+            List of (sentiment_label, confidence_score) tuples, one per text
+        """
+        if not texts:
+            return []
+        
+        analyzer = self._get_sentiment_analyzer()
+        if not analyzer:
+            return [self._fallback_sentiment(text) for text in texts]
+        
+        keys = [text.strip() for text in texts]
+        # Empty texts are neutral without a model call
+        sentiments = [self._get_cached_sentiment(key) if key else ('neutral', 0.0) for key in keys]
+        # Each distinct uncached text goes through the model once
+        pending = list(dict.fromkeys(key for key, sentiment in zip(keys, sentiments) if sentiment is None))
+        
+        try:
+            computed = {}
+            if pending:
+                pending.sort(key=len)
+                with _inference_mode():
+                    results = analyzer(
+                        pending,
+                        batch_size=batch_size,
+                        truncation=True,
+                        max_length=MAX_SEQUENCE_LENGTH
+                    )
+                for key, result in zip(pending, results):
+                    computed[key] = self._map_sentiment_result(result)
+                    self._cache_sentiment(key, computed[key])
             
-            #Convert score to sentiment score(-1 to 1)
-            if mapped_label == 'positive':
-                sentiment_score = score
-            elif mapped_label == 'negative':
-                sentiment_score = -score
-            else:
-                sentiment_score = 0.0
-                
-            return mapped_label, sentiment_score
+            return [
+                sentiment if sentiment is not None else computed[key]
+                for key, sentiment in zip(keys, sentiments)
+            ]
             
         except Exception as e:
-            logger.error(f"Sentiment analysis failed: {e}")
-            return self._fallback_sentiment(text)
+            logger.error(f"Batch sentiment analysis failed: {e}")
+            return [self._fallback_sentiment(text) for text in texts]
     
-    def _fallback_sentiment(self, text: str) -> Tuple[str, float]:
-        """Simple fallback sentiment analysis."""
-        text_lower = text.lower()
+    def _get_cached_sentiment(self, key: str):
+        """Return the cached sentiment for a text, or None."""
+        with self._sentiment_cache_lock:
+            sentiment = self._sentiment_cache.get(key)
+            if sentiment is not None:
+                self._sentiment_cache.move_to_end(key)
+            return sentiment
+    
+    def _cache_sentiment(self, key: str, sentiment: Tuple[str, float]):
+        """Store a model sentiment result, evicting the least recently used entry when full."""
+        with self._sentiment_cache_lock:
+            self._sentiment_cache[key] = sentiment
+            self._sentiment_cache.move_to_end(key)
+            if len(self._sentiment_cache) > ANALYSIS_CACHE_SIZE:
+                self._sentiment_cache.popitem(last=False)
+    
+    def clear_caches(self):
+        """Drop cached sentiment and keyword feature results."""
+        with self._sentiment_cache_lock:
+            self._sentiment_cache.clear()
+        _analyze_features.cache_clear()
+    
+    def _map_sentiment_result(self, result: dict) -> Tuple[str, float]:
+        """Convert a pipeline result into a (label, score in -1..1) tuple."""
+        label = result['label'].lower()
+        score = result['score']
+        
+        #Map labels to consistent format
+        label_mapping = {
+            'positive': 'positive',
+            'negative': 'negative',
+            'neutral': 'neutral'
+        }
         
-        positive_words = ['good', 'great', 'excellent', 'amazing', 'love', 'best', 'wonderful']
-        negative_words = ['bad', 'terrible', 'awful', 'hate', 'worst', 'horrible', 'disappointed']
+        mapped_label = label_mapping.get(label, 'neutral')
+        if self.neutral_threshold is not None and score < self.neutral_threshold:
+            mapped_label = 'neutral'
         
-        pos_count = sum(1 for word in positive_words if word in text_lower)
-        neg_count = sum(1 for word in negative_words if word in text_lower)
+        #Convert score to sentiment score(-1 to 1)
+        if mapped_label == 'positive':
+            sentiment_score = score
+        elif mapped_label == 'negative':
+            sentiment_score = -score
+        else:
+            sentiment_score = 0.0
+            
+        return mapped_label, sentiment_score
+    
+    def _fallback_sentiment(self, text: str) -> Tuple[str, float]:
+        """Simple fallback sentiment analysis."""
+        features = _analyze_features(text.lower())
+        pos_count = features.positive_words
+        neg_count = features.negative_words
         
         if pos_count > neg_count:
             return 'positive', 0.7
@@ -109,28 +442,23 @@ class AIService:
         """
         Extract topics from review text using simple keyword matching.
         """
-        text_lower = text.lower()
+        if not text or text.isspace():
+            return []
         
-        # Define topic keywords
-        topic_keywords = {
-            'food quality': ['taste', 'flavor', 'delicious', 'fresh', 'quality', 'food'],
-            'service': ['service', 'staff', 'waiter', 'waitress', 'server', 'friendly', 'rude'],
-            'atmosphere': ['atmosphere', 'ambiance', 'music', 'noise', 'crowded', 'quiet'],
-            'price': ['price', 'cost', 'expensive', 'cheap', 'value', 'money'],
-            'delivery': ['delivery', 'arrived', 'late', 'fast', 'quick', 'slow'],
-            'cleanliness': ['clean', 'dirty', 'hygiene', 'mess', 'tidy'],
-            'location': ['location', 'parking', 'access', 'convenient', 'far'],
-            'wait time': ['wait', 'waiting', 'long', 'quick', 'fast', 'slow']
-        }
-        
-        identified_topics = []
-        for topic, keywords in topic_keywords.items():
-            if any(keyword in text_lower for keyword in keywords):
-                identified_topics.append(topic)
-        
-        return identified_topics[:3]  #Return max 3 topics
+        return list(_analyze_features(text.lower()).topics)
     
-    def suggest_reply(self, review_text: str, rating: int, sentiment: str) -> Dict[str, any]: # type: ignore
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Return the pooled HTTP client, creating it if it doesn't exist or was closed."""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(timeout=REPLY_HTTP_TIMEOUT, limits=REPLY_HTTP_LIMITS)
+        return self._http
+    
+    async def close(self):
+        """Close the pooled HTTP client used for reply generation."""
+        if self._http is not None:
+            await self._http.aclose()
+    
+    async def suggest_reply(self, review_text: str, rating: int, sentiment: str) -> Dict[str, any]: # type: ignore
         """
         Generate a suggested reply to a customer review.
         Args:
@@ -146,7 +474,7 @@ class AIService:
             
             #Generate reply using Perplexity API or fallback
             if self.perplexity_api_key and self.perplexity_endpoint and len(review_text) < 400:
-                reply = self.generate_ai_reply(
+                reply = await self.generate_ai_reply(
                     review_text, 
                     tone, 
                     rating,
@@ -179,7 +507,7 @@ class AIService:
         else:
             return 'professional'
     
-    def generate_ai_reply(
+    async def generate_ai_reply(
         self, 
         review_text: str, 
         tone: str, 
@@ -200,21 +528,8 @@ class AIService:
                 logger.warning(f"Endpoint: {self.perplexity_endpoint}")
                 return self._generate_template_reply(rating, 'neutral')
             
-            logger.info(f"API Key available: {self.perplexity_api_key[:10]}...")
-            
-            #Create a prompt for the AI
-            prompt = f"""You are a professional restaurant manager responding to a customer review. 
-                    Write a {tone} and helpful response to this {rating}-star review: "{review_text[:300]}"
-
-                    Guidelines:
-                    - Keep the response under 150 words
-                    - Be genuine and specific to the review
-                    - If it's a positive review, express gratitude
-                    - If it's a negative review, acknowledge concerns and offer solutions
-                    - Maintain a professional but warm tone
-                    - Don't make promises you can't keep
-
-                    Response:"""
+            #Create a prompt for the AI; only the review-specific part is formatted per call
+            prompt = f'{_PROMPT_PREFIX}Write a {tone} and helpful response to this {rating}-star review: "{review_text[:300]}"{_PROMPT_SUFFIX}'
             
             headers = {
                 "Authorization": f"Bearer {self.perplexity_api_key}",
@@ -236,22 +551,12 @@ class AIService:
                 "frequency_penalty": frequency_penalty
             }
             
-            logger.info(f"Payload being sent: {json.dumps(payload, indent=2)}")
-            logger.info(f"Calling Perplexity API with model: {model}")
-            response = requests.post(
-                self.perplexity_endpoint,
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
-
-            logger.info(f"ai response: {response}")
-            
-            logger.info(f"Perplexity API response status: {response.status_code}")
+            logger.debug("Calling Perplexity API with model=%s max_tokens=%s", model, max_tokens)
+            response = await self._post_with_retry(payload, headers)
+            logger.debug("Perplexity API response status: %s", response.status_code)
             
             if response.status_code == 200:
                 result = response.json()
-                logger.info(f"Perplexity API response: {result}")
                 
                 # Extract the reply from the response
                 choices = result.get('choices', [])
@@ -267,16 +572,45 @@ class AIService:
                 logger.error(f"Perplexity API error: {response.status_code} - {response.text}")
                 return self._generate_template_reply(rating, 'neutral')
                 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             logger.error("Perplexity API call timed out")
             return self._generate_template_reply(rating, 'neutral')
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Perplexity API request failed: {e}")
             return self._generate_template_reply(rating, 'neutral')
         except Exception as e:
             logger.error(f"Perplexity API call failed: {e}")
             return self._generate_template_reply(rating, 'neutral')
     
+    async def _post_with_retry(self, payload: dict, headers: dict) -> httpx.Response:
+        """
+        POST to the Perplexity endpoint, retrying rate limits, gateway errors
+        and read or connect failures with jittered exponential backoff.
+        
+        A Retry-After header in seconds takes precedence over the backoff.
+        Non-retryable responses are returned as-is; once the attempts are used
+        up the last error is raised.
+        """
+        for attempt in range(1, REPLY_MAX_ATTEMPTS + 1):
+            try:
+                response = await self._get_http_client().post(self.perplexity_endpoint, json=payload, headers=headers)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response
+                response.raise_for_status()
+            except (httpx.HTTPStatusError, httpx.ReadTimeout, httpx.ConnectError) as e:
+                if attempt == REPLY_MAX_ATTEMPTS:
+                    raise
+                delay = min(REPLY_RETRY_MAX_WAIT, REPLY_RETRY_INITIAL_WAIT * 2 ** (attempt - 1))
+                delay += random.uniform(0, REPLY_RETRY_INITIAL_WAIT)
+                reason = type(e).__name__
+                if isinstance(e, httpx.HTTPStatusError):
+                    reason = f"status {e.response.status_code}"
+                    retry_after = e.response.headers.get('Retry-After', '')
+                    if retry_after.isdigit():
+                        delay = min(REPLY_RETRY_MAX_WAIT, float(retry_after))
+                logger.warning(f"Perplexity API attempt {attempt} failed ({reason}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
     def _generate_template_reply(self, rating: int, sentiment: str) -> str:
         """Generate reply using templates."""
         if rating >= 4:
@@ -288,22 +622,10 @@ class AIService:
     
     def _extract_key_points(self, review_text: str, sentiment: str) -> List[str]:
         """Extract key points that should be addressed in the reply."""
-        text_lower = review_text.lower()
-        key_points = []
-        
-        # Common issues to address
-        issue_keywords = {
-            'Thank customer for feedback': ['review', 'feedback'],
-            'Address food quality concerns': ['food', 'taste', 'cold', 'hot'],
-            'Acknowledge service issues': ['service', 'staff', 'waiter', 'slow'],
-            'Apologize for wait time': ['wait', 'long', 'slow', 'late'],
-            'Address cleanliness concerns': ['clean', 'dirty', 'mess'],
-            'Acknowledge pricing feedback': ['expensive', 'price', 'cost', 'value']
-        }
+        if not review_text or review_text.isspace():
+            return []
         
-        for point, keywords in issue_keywords.items():
-            if any(keyword in text_lower for keyword in keywords):
-                key_points.append(point)
+        key_points = list(_analyze_features(review_text.lower()).key_points)
         
         # Always thank for positive reviews
         if sentiment == 'positive':
@@ -330,7 +652,7 @@ def test_ai_reply():
     test_rating = 5
     test_sentiment = "positive"
     
-    result = ai_service.suggest_reply(test_review, test_rating, test_sentiment)
+    result = asyncio.run(ai_service.suggest_reply(test_review, test_rating, test_sentiment))
     print(f"Result: {result}")
     return result
 
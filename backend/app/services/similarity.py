@@ -1,13 +1,78 @@
 """Similarity search service using TF-IDF and cosine similarity."""
 
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+import scipy.sparse
+import joblib
 from typing import List, Tuple
+import json
 import logging
+import os
+import threading
+
+try:
+    import hnswlib
+except ImportError:  # ANN search is optional, exact search is used without it
+    hnswlib = None
+
+try:
+    from numba import njit
+except ImportError:  # the exact scan falls back to a scipy sparse matvec without numba
+    njit = None
 
 logger = logging.getLogger(__name__)
 
+if njit is not None:
+    # Not parallel: lookups are already serialized by the service lock and numba's
+    # parallel runtime hangs interpreter shutdown when driven from worker threads
+    @njit(fastmath=True, cache=True)
+    def _csr_row_dots(data, indices, indptr, query):
+        """Dot product of every row of a CSR matrix with a dense query vector."""
+        n_rows = indptr.shape[0] - 1
+        scores = np.zeros(n_rows, dtype=np.float64)
+        for row in range(n_rows):
+            total = 0.0
+            for pos in range(indptr[row], indptr[row + 1]):
+                total += data[pos] * query[indices[pos]]
+            scores[row] = total
+        return scores
+else:
+    _csr_row_dots = None
+
+def _review_ids(reviews: List[dict]) -> np.ndarray:
+    """Review ids as an int64 array, in row order."""
+    return np.fromiter((review['id'] for review in reviews), dtype=np.int64, count=len(reviews))
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without sorting the whole array."""
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= scores.shape[0]:
+        return np.argsort(scores)[::-1]
+    
+    candidates = np.argpartition(scores, -k)[-k:]
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+def _add_ann_items(index, vectors, start: int):
+    """Add TF-IDF rows to an HNSW index, labelled with their row positions from start."""
+    for offset in range(0, vectors.shape[0], ANN_BATCH_SIZE):
+        batch = vectors[offset:offset + ANN_BATCH_SIZE].toarray().astype(np.float32)
+        labels = np.arange(start + offset, start + offset + batch.shape[0])
+        index.add_items(batch, labels)
+
+# HNSW search is opt-in with SIMILARITY_ANN=1. The exact scan stays at a few
+# milliseconds per query up to ~100k reviews, while building the graph takes
+# tens of seconds at 20k reviews and makes results approximate.
+ANN_ENABLED = os.getenv('SIMILARITY_ANN', '').lower() in ('1', 'true', 'yes')
+# Below this many reviews the exact scan is used even when ANN search is enabled
+ANN_MIN_REVIEWS = 250000
+# Rows densified at a time when feeding TF-IDF vectors into the HNSW index
+ANN_BATCH_SIZE = 10000
+# Rows fetched per round trip when loading reviews from the database
+DB_LOAD_BATCH_SIZE = 10000
+# Fitted vectorizer and TF-IDF matrix are saved here so restarts can skip the refit
+SIMILARITY_INDEX_DIR = os.getenv('SIMILARITY_INDEX_DIR', 'data/similarity_index')
+
 class SimilarityService:
     """Service for finding similar reviews using TF-IDF and cosine similarity."""
     
@@ -17,10 +82,31 @@ class SimilarityService:
             max_features=1000,
             stop_words='english',
             lowercase=True,
-            ngram_range=(1, 2)  # Include unigrams and bigrams
+            ngram_range=(1, 2),  # Include unigrams and bigrams
+            norm='l2'  # find_similar relies on unit-length rows to score cosine as a dot product
         )
         self.tfidf_matrix = None
         self.reviews_data = []
+        # Review ids by matrix row, kept as an array so result rows map to ids without dict lookups
+        self._ids = np.empty(0, dtype=np.int64)
+        # Number of reviews the vectorizer vocabulary was last fitted on
+        self.fitted_count = 0
+        # HNSW index over the TF-IDF rows, labelled by row position; built in a
+        # background thread and swapped in, the exact scan serves until then
+        self.ann_index = None
+        self.ann_enabled = ANN_ENABLED and hnswlib is not None
+        self.ann_min_reviews = ANN_MIN_REVIEWS
+        self._ann_thread = None
+        # Bumped on every vocabulary fit, so a graph built from older vectors is discarded
+        self._fit_generation = 0
+        # Bumped whenever the index changes so cached search results can be keyed on it
+        self.version = 0
+        # Fitted analyzer, vocabulary and IDF weights used by _vectorize_query
+        self._analyzer = None
+        self._vocab = {}
+        self._idf = None
+        # Routes run in FastAPI's threadpool, so index updates and lookups are serialized
+        self._lock = threading.RLock()
     
     def build_index(self, reviews: List[dict]):
         """
@@ -29,24 +115,132 @@ class SimilarityService:
         Args:
             reviews: List of review dictionaries with 'id' and 'review_text'
         """
-        if not reviews:
-            logger.warning("No reviews provided for building similarity index")
-            return
+        with self._lock:
+            if not reviews:
+                logger.warning("No reviews provided for building similarity index")
+                return
+            
+            try:
+                #Extract review texts
+                texts = [review['review_text'] for review in reviews]
+                self.reviews_data = reviews
+                self._ids = _review_ids(reviews)
+                
+                #Build TF-IDF matrix
+                self.tfidf_matrix = self.vectorizer.fit_transform(texts).tocsr()
+                self.fitted_count = len(reviews)
+                # Cached so queries are vectorized without going through transform()
+                self._analyzer = self.vectorizer.build_analyzer()
+                self._vocab = self.vectorizer.vocabulary_
+                self._idf = self.vectorizer.idf_
+                self.ann_index = None
+                self._fit_generation += 1
+                self._schedule_ann_build()
+                self.version += 1
+                
+                logger.info(f"Built similarity index with {len(reviews)} reviews")
+                
+            except Exception as e:
+                logger.error(f"Failed to build similarity index: {e}")
+                self.tfidf_matrix = None
+                self.reviews_data = []
+                self._ids = np.empty(0, dtype=np.int64)
+                self.fitted_count = 0
+                self.ann_index = None
+    
+    def add_documents(self, reviews: List[dict]):
+        """
+        Append new reviews to the existing TF-IDF index.
         
-        try:
-            #Extract review texts
-            texts = [review['review_text'] for review in reviews]
-            self.reviews_data = reviews
+        New rows are vectorized with the already fitted vocabulary, so the cost
+        is proportional to the batch size rather than the corpus size. The
+        vocabulary is refitted once the corpus has doubled since the last fit.
+        
+        Args:
+            reviews: List of review dictionaries with 'id' and 'review_text'
             
-            #Build TF-IDF matrix
-            self.tfidf_matrix = self.vectorizer.fit_transform(texts)
+        Raises:
+            Exception: If the reviews could not be appended; the index is then
+                out of date and should be rebuilt from the database
+        """
+        with self._lock:
+            if not reviews:
+                return
             
-            logger.info(f"Built similarity index with {len(reviews)} reviews")
+            if self.tfidf_matrix is None or len(self.reviews_data) + len(reviews) >= 2 * self.fitted_count:
+                self.build_index(self.reviews_data + list(reviews))
+                return
             
+            try:
+                start = self.tfidf_matrix.shape[0]
+                new_vectors = self.vectorizer.transform([review['review_text'] for review in reviews])
+                self.tfidf_matrix = scipy.sparse.vstack([self.tfidf_matrix, new_vectors]).tocsr()
+                self.reviews_data = self.reviews_data + list(reviews)
+                self._ids = np.concatenate([self._ids, _review_ids(reviews)])
+                
+                if self.ann_index is None:
+                    self._schedule_ann_build()
+                else:
+                    self.ann_index.resize_index(self.tfidf_matrix.shape[0])
+                    _add_ann_items(self.ann_index, new_vectors, start)
+                self.version += 1
+                
+                logger.info(f"Added {len(reviews)} reviews to similarity index")
+                
+            except Exception as e:
+                logger.error(f"Failed to add reviews to similarity index: {e}")
+                raise
+    
+    def _schedule_ann_build(self):
+        """
+        Start building the HNSW index in a background thread if ANN search is
+        enabled and the corpus is large enough. Called with the lock held.
+        """
+        if not self.ann_enabled or self.tfidf_matrix is None or self.tfidf_matrix.shape[0] < self.ann_min_reviews:
+            return
+        if self._ann_thread is not None:
+            # The running build picks up rows appended meanwhile when it swaps in
+            return
+        
+        self._ann_thread = threading.Thread(
+            target=self._build_ann_index,
+            args=(self.tfidf_matrix, self._fit_generation),
+            daemon=True
+        )
+        self._ann_thread.start()
+    
+    def _build_ann_index(self, matrix, generation: int):
+        """
+        Build an HNSW index over matrix without holding the lock, then swap it
+        in, first adding any rows appended while it was being built.
+        """
+        try:
+            # TF-IDF rows are L2-normalized, so inner product equals cosine similarity
+            index = hnswlib.Index(space='ip', dim=matrix.shape[1])
+            index.init_index(max_elements=matrix.shape[0], ef_construction=200, M=16)
+            index.set_ef(64)
+            _add_ann_items(index, matrix, 0)
         except Exception as e:
-            logger.error(f"Failed to build similarity index: {e}")
-            self.tfidf_matrix = None
-            self.reviews_data = []
+            logger.error(f"Failed to build HNSW index: {e}")
+            with self._lock:
+                self._ann_thread = None
+            return
+        
+        with self._lock:
+            self._ann_thread = None
+            if generation != self._fit_generation:
+                # The vocabulary was refitted meanwhile, so these vectors are stale
+                self._schedule_ann_build()
+                return
+            
+            built = matrix.shape[0]
+            if self.tfidf_matrix.shape[0] > built:
+                index.resize_index(self.tfidf_matrix.shape[0])
+                _add_ann_items(index, self.tfidf_matrix[built:], built)
+            self.ann_index = index
+            self.version += 1
+            
+            logger.info(f"Built HNSW index with {self.tfidf_matrix.shape[0]} reviews")
     
     def find_similar(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
         """
@@ -59,66 +253,237 @@ class SimilarityService:
         Returns:
             List of tuples (review_id, similarity_score)
         """
-        if self.tfidf_matrix is None or not self.reviews_data:
-            logger.warning("Similarity index not built. Call build_index first.")
-            return []
-        
-        try:
-            # Transform query using the same vectorizer
-            query_vector = self.vectorizer.transform([query])
+        with self._lock:
+            if self.tfidf_matrix is None or not self.reviews_data:
+                logger.warning("Similarity index not built. Call build_index first.")
+                return []
             
-            # Calculate cosine similarity
-            similarity_scores = cosine_similarity(query_vector, self.tfidf_matrix).flatten()
+            if not query or query.isspace():
+                return []
             
-            # Get top k similar reviews
-            top_indices = np.argsort(similarity_scores)[::-1][:k]
+            try:
+                # Transform query using the same vectorizer
+                query_vector = self._vectorize_query(query)
+                if query_vector.nnz == 0:
+                    # No query term is in the vocabulary, so every score is zero
+                    return []
+                
+                if self.ann_index is not None:
+                    return self._find_similar_ann(query_vector, k)
+                
+                # Calculate cosine similarity: rows and query are L2-normalized,
+                # so cosine is a plain dot product
+                if _csr_row_dots is not None:
+                    similarity_scores = _csr_row_dots(
+                        self.tfidf_matrix.data,
+                        self.tfidf_matrix.indices,
+                        self.tfidf_matrix.indptr,
+                        query_vector.toarray().ravel()
+                    )
+                else:
+                    similarity_scores = (self.tfidf_matrix @ query_vector.T).toarray().ravel()
+                
+                # Get top k similar reviews, only including non-zero similarities
+                top_indices = _top_k_indices(similarity_scores, k)
+                top_indices = top_indices[similarity_scores[top_indices] > 0]
+                
+                return list(zip(self._ids[top_indices].tolist(), similarity_scores[top_indices].tolist()))
+                
+            except Exception as e:
+                logger.error(f"Similarity search failed: {e}")
+                return []
+    
+    def _vectorize_query(self, query: str) -> scipy.sparse.csr_matrix:
+        """
+        TF-IDF vector for a single query, equal to vectorizer.transform([query]).
+        
+        Builds the one-row CSR matrix directly from the cached analyzer,
+        vocabulary and IDF weights, skipping transform()'s validation and
+        intermediate count matrix.
+        """
+        counts = {}
+        for term in self._analyzer(query):
+            col = self._vocab.get(term)
+            if col is not None:
+                counts[col] = counts.get(col, 0) + 1
+        
+        cols = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+        data = np.fromiter((counts[col] for col in cols), dtype=np.float64, count=len(cols)) * self._idf[cols]
+        norm = np.sqrt(np.dot(data, data))
+        if norm > 0:
+            data /= norm
+        
+        return scipy.sparse.csr_matrix(
+            (data, cols, np.array([0, len(cols)], dtype=np.int32)),
+            shape=(1, len(self._idf))
+        )
+    
+    def _find_similar_ann(self, query_vector, k: int) -> List[Tuple[int, float]]:
+        """Approximate top-k search through the HNSW index."""
+        k = min(k, self.ann_index.get_current_count())
+        labels, distances = self.ann_index.knn_query(query_vector.toarray().astype(np.float32), k=k)
+        
+        scores = 1.0 - distances[0].astype(np.float64)
+        mask = scores > 0  # Only include non-zero similarities
+        return list(zip(self._ids[labels[0][mask]].tolist(), scores[mask].tolist()))
+    
+    def save_index(self, index_dir: str = SIMILARITY_INDEX_DIR):
+        """
+        Save the fitted vectorizer, the TF-IDF matrix and, if built, the HNSW
+        graph to index_dir.
+        
+        The metadata file is removed first and written last, so an interrupted
+        save is never loaded.
+        """
+        with self._lock:
+            if self.tfidf_matrix is None:
+                return
             
-            results = []
-            for idx in top_indices:
-                if similarity_scores[idx] > 0:  # Only include non-zero similarities
-                    review_id = self.reviews_data[idx]['id']
-                    score = float(similarity_scores[idx])
-                    results.append((review_id, score))
+            try:
+                os.makedirs(index_dir, exist_ok=True)
+                meta_path = os.path.join(index_dir, 'meta.json')
+                if os.path.exists(meta_path):
+                    os.remove(meta_path)
+                
+                joblib.dump(self.vectorizer, os.path.join(index_dir, 'vectorizer.joblib'))
+                scipy.sparse.save_npz(os.path.join(index_dir, 'tfidf.npz'), self.tfidf_matrix)
+                ann_count = None
+                if self.ann_index is not None:
+                    self.ann_index.save_index(os.path.join(index_dir, 'ann.bin'))
+                    ann_count = self.ann_index.get_current_count()
+                with open(meta_path, 'w') as f:
+                    json.dump({
+                        'count': len(self.reviews_data),
+                        'max_id': int(self._ids[-1]),
+                        'fitted_count': self.fitted_count,
+                        'ann_count': ann_count
+                    }, f)
+                
+                logger.info(f"Saved similarity index with {len(self.reviews_data)} reviews to {index_dir}")
+                
+            except Exception as e:
+                logger.error(f"Failed to save similarity index: {e}")
+    
+    def _load_saved_index(self, reviews: List[dict], index_dir: str) -> bool:
+        """
+        Load a saved index if it covers a prefix of reviews (sorted by id) and
+        append the rest.
+        
+        Everything is loaded and appended into locals first and only assigned
+        once it has all succeeded, so a False return (no usable saved index)
+        leaves the service as it was.
+        """
+        try:
+            with open(os.path.join(index_dir, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        
+        count = meta.get('count', 0)
+        if not 0 < count <= len(reviews) or reviews[count - 1]['id'] != meta.get('max_id'):
+            return False
+        
+        try:
+            vectorizer = joblib.load(os.path.join(index_dir, 'vectorizer.joblib'))
+            tfidf_matrix = scipy.sparse.load_npz(os.path.join(index_dir, 'tfidf.npz')).tocsr()
+            if tfidf_matrix.shape[0] != count:
+                return False
             
-            return results
+            ann_index = None
+            if self.ann_enabled and meta.get('ann_count') == count:
+                ann_index = hnswlib.Index(space='ip', dim=tfidf_matrix.shape[1])
+                ann_index.load_index(os.path.join(index_dir, 'ann.bin'), max_elements=len(reviews))
+                ann_index.set_ef(64)
             
+            # Reviews ingested after the index was saved
+            new_reviews = reviews[count:]
+            if new_reviews:
+                new_vectors = vectorizer.transform([review['review_text'] for review in new_reviews])
+                tfidf_matrix = scipy.sparse.vstack([tfidf_matrix, new_vectors]).tocsr()
+                if ann_index is not None:
+                    _add_ann_items(ann_index, new_vectors, count)
         except Exception as e:
-            logger.error(f"Similarity search failed: {e}")
-            return []
+            logger.error(f"Failed to load saved similarity index: {e}")
+            return False
+        
+        with self._lock:
+            self.vectorizer = vectorizer
+            self.tfidf_matrix = tfidf_matrix
+            self.reviews_data = list(reviews)
+            self._ids = _review_ids(self.reviews_data)
+            self.fitted_count = meta.get('fitted_count', count)
+            self._analyzer = vectorizer.build_analyzer()
+            self._vocab = vectorizer.vocabulary_
+            self._idf = vectorizer.idf_
+            self.ann_index = ann_index
+            self._fit_generation += 1
+            if ann_index is None:
+                self._schedule_ann_build()
+            self.version += 1
+            
+            logger.info(
+                f"Loaded similarity index with {count} reviews from {index_dir}, "
+                f"appended {len(new_reviews)} newer reviews"
+            )
+        return True
+    
+    def warmup(self):
+        """
+        Run one throwaway query so the first real search doesn't pay for lazy
+        imports in scikit-learn or compiling the numba kernel.
+        """
+        if _csr_row_dots is not None:
+            empty = scipy.sparse.csr_matrix((1, 1))
+            _csr_row_dots(empty.data, empty.indices, empty.indptr, np.zeros(1))
+        if self.tfidf_matrix is not None:
+            self.find_similar("warmup", k=1)
     
     def get_index_stats(self) -> dict:
         """Get statistics about the similarity index."""
         return {
             'total_reviews': len(self.reviews_data),
             'vocabulary_size': len(self.vectorizer.vocabulary_) if self.tfidf_matrix is not None else 0,
-            'index_built': self.tfidf_matrix is not None
+            'index_built': self.tfidf_matrix is not None,
+            'ann_index_built': self.ann_index is not None
         }
     
-    def initialize_from_database(self, db_session):
+    def initialize_from_database(self, db_session, index_dir: str = SIMILARITY_INDEX_DIR):
         """
         Initialize the similarity index from existing reviews in the database.
         
         This method should be called on application startup to ensure the
         similarity search functionality works with existing data.
         
+        A saved index from a previous run is reused when it still matches the
+        database, so only reviews added since it was saved are vectorized.
+        
         Args:
             db_session: SQLAlchemy database session
+            index_dir: Directory the fitted index is saved to and loaded from
         """
         try:
             # Import here to avoid circular imports
             from ..models import Review as ReviewModel
             
-            # Get all existing reviews
-            all_reviews = db_session.query(ReviewModel).all()
+            # Only the indexed columns are loaded, not whole Review objects, and
+            # rows are fetched from the cursor in batches rather than all at once
+            rows = (
+                db_session.query(ReviewModel.id, ReviewModel.review_text)
+                .order_by(ReviewModel.id)
+                .yield_per(DB_LOAD_BATCH_SIZE)
+            )
+            reviews_for_index = [
+                {'id': review_id, 'review_text': review_text}
+                for review_id, review_text in rows
+            ]
             
-            if all_reviews:
+            if reviews_for_index and self._load_saved_index(reviews_for_index, index_dir):
+                logger.info(f"Similarity index initialized from saved index with {len(reviews_for_index)} reviews")
+            elif reviews_for_index:
                 # Build similarity index
-                reviews_for_index = [
-                    {'id': r.id, 'review_text': r.review_text} 
-                    for r in all_reviews
-                ]
                 self.build_index(reviews_for_index)
-                logger.info(f"Similarity index initialized from database with {len(all_reviews)} reviews")
+                self.save_index(index_dir)
+                logger.info(f"Similarity index initialized from database with {len(reviews_for_index)} reviews")
             else:
                 logger.info("No existing reviews found in database, similarity index will be built when reviews are added")
                 
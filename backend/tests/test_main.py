@@ -3,11 +3,14 @@ from fastapi.testclient import TestClient
 import json
 import sys
 import os
+import uuid
+import numpy as np
 
 #add backend app to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from app.main import  app
+from app.services.similarity import SimilarityService
 
 client = TestClient(app)
 
@@ -55,6 +58,12 @@ def test_ingest_reviews_success():
     assert "message" in data
     assert data["count"] == 2
 
+def test_ingest_empty_batch():
+    """Test ingesting an empty list inserts nothing and succeeds."""
+    response = client.post("/ingest", json=[])
+    assert response.status_code == 200
+    assert response.json()["count"] == 0
+
 #Error path test - invalid review payload
 def test_ingest_reviews_invalid_payload():
     """Test review ingestion with invalid payload."""
@@ -83,6 +92,62 @@ def test_get_reviews():
     assert "page" in data
     assert "pages" in data
 
+def test_get_reviews_cursor_pagination():
+    """Test paging with after_id and has_next, skipping the total count."""
+    location = f"Cursor Test {uuid.uuid4().hex[:12]}"
+    reviews = [
+        {
+            "business_name": "Test Restaurant",
+            "location": location,
+            "customer_name": f"Customer {i}",
+            "rating": 4,
+            "review_text": f"Visit number {i}",
+            "date": "2024-01-15"
+        }
+        for i in range(3)
+    ]
+    
+    with TestClient(app) as started_client:
+        assert started_client.post("/ingest", json=reviews).status_code == 200
+        params = {"location": location, "limit": 2, "exact_total": "false"}
+        
+        first = started_client.get("/reviews", params=params).json()
+        assert first["total"] is None and first["pages"] is None
+        assert first["has_next"] is True
+        assert len(first["reviews"]) == 2
+        
+        second = started_client.get(
+            "/reviews", params={**params, "after_id": first["reviews"][-1]["id"]}
+        ).json()
+        assert second["has_next"] is False
+        assert len(second["reviews"]) == 1
+        seen = {r["id"] for r in first["reviews"]} | {r["id"] for r in second["reviews"]}
+        assert len(seen) == 3
+        
+        exact = started_client.get("/reviews", params={"location": location, "limit": 2}).json()
+        assert exact["total"] == 3 and exact["pages"] == 2
+        
+        # The cursor follows (created_at, id) order even when a later id is older
+        from datetime import datetime
+        from app.database import SessionLocal
+        from app.models import Review as ReviewModel
+        newest_id = max(seen)
+        with SessionLocal() as session:
+            session.query(ReviewModel).filter(ReviewModel.id == newest_id).update(
+                {ReviewModel.created_at: datetime(2000, 1, 1)}
+            )
+            session.commit()
+        
+        paged, after_id = [], None
+        while True:
+            page_params = {**params, "after_id": after_id} if after_id else params
+            page = started_client.get("/reviews", params=page_params).json()
+            paged += [r["id"] for r in page["reviews"]]
+            if not page["has_next"]:
+                break
+            after_id = paged[-1]
+        assert paged == sorted(seen - {newest_id}, reverse=True) + [newest_id]
+
 def test_get_analytics():
     """Test analytics endpoint."""
     response = client.get("/analytics")
@@ -94,6 +159,27 @@ def test_get_analytics():
     assert "rating_distribution" in data
     assert "location_stats" in data
 
+def test_get_analytics_refreshes_after_ingest():
+    """Test cached analytics are recomputed once new reviews are ingested."""
+    location = f"Analytics Test {uuid.uuid4().hex[:12]}"
+    review = {
+        "business_name": "Test Restaurant",
+        "location": location,
+        "customer_name": "John Doe",
+        "rating": 3,
+        "review_text": "Average food.",
+        "date": "2024-01-15"
+    }
+    
+    with TestClient(app) as started_client:
+        before = started_client.get("/analytics").json()
+        assert started_client.get("/analytics").json() == before
+        assert location not in before["location_stats"]
+        
+        assert started_client.post("/ingest", json=[review]).status_code == 200
+        after = started_client.get("/analytics").json()
+        assert after["location_stats"][location] == 1
+
 def test_search_similar_reviews():
     """Test similarity search."""
     response = client.get("/search?q=great food&k=5")
@@ -104,5 +190,276 @@ def test_search_similar_reviews():
     assert "query" in data
     assert data["query"] == "great food"
 
+SIMILARITY_REVIEWS = [
+    {"id": i, "review_text": text}
+    for i, text in enumerate([
+        "Great food and excellent service",
+        "The pizza was cold and the waiter was rude",
+        "Cheap prices, good value for money",
+        "Slow delivery, food arrived late and cold",
+        "Lovely quiet atmosphere and friendly staff",
+        "Dirty tables but the pasta tasted fresh",
+    ])
+]
+
+def test_similarity_ann_index_matches_exact_search():
+    """Test HNSW search returns the same neighbours as the exact scan."""
+    pytest.importorskip("hnswlib")
+    exact = SimilarityService()
+    exact.build_index(SIMILARITY_REVIEWS)
+    ann = SimilarityService()
+    ann.ann_enabled = True
+    ann.ann_min_reviews = 1
+    ann.build_index(SIMILARITY_REVIEWS)
+    # The graph is built in the background; the exact scan answers until it is swapped in
+    thread = ann._ann_thread
+    if thread is not None:
+        thread.join()
+    
+    assert ann.get_index_stats()["ann_index_built"]
+    exact_ids = {review_id for review_id, _ in exact.find_similar("cold food", k=3)}
+    ann_ids = {review_id for review_id, _ in ann.find_similar("cold food", k=3)}
+    assert ann_ids == exact_ids
+
+def test_similarity_add_documents_appends_then_refits():
+    """Test new reviews are appended with the fitted vocabulary until the corpus doubles."""
+    service = SimilarityService()
+    service.build_index(SIMILARITY_REVIEWS[:4])
+    vocabulary = dict(service.vectorizer.vocabulary_)
+    
+    # Appended with the frozen vocabulary and immediately searchable
+    service.add_documents([{"id": 100, "review_text": "Rude waiter, cold pizza, awful night"}])
+    assert service.fitted_count == 4
+    assert service.tfidf_matrix.shape[0] == 5
+    assert service.vectorizer.vocabulary_ == vocabulary
+    assert service.find_similar("rude waiter cold pizza", k=1)[0][0] == 100
+    
+    # Reaching twice the fitted size refits the vocabulary on the whole corpus
+    service.add_documents([
+        {"id": 101, "review_text": "Wonderful sushi rolls"},
+        {"id": 102, "review_text": "Sushi was stale"},
+        {"id": 103, "review_text": "Best ramen in town"},
+    ])
+    assert service.fitted_count == 8
+    assert service.tfidf_matrix.shape[0] == 8
+    assert "sushi" in service.vectorizer.vocabulary_
+    assert service.find_similar("sushi", k=2)[0][0] in (101, 102)
+
+def test_similarity_numba_scores_match_cosine_similarity():
+    """Test the numba exact-scan kernel scores like scikit-learn's cosine_similarity."""
+    pytest.importorskip("numba")
+    from sklearn.metrics.pairwise import cosine_similarity
+    from app.services.similarity import _csr_row_dots
+    
+    service = SimilarityService()
+    service.build_index(SIMILARITY_REVIEWS)
+    query_vector = service.vectorizer.transform(["cold food and rude waiter"])
+    
+    scores = _csr_row_dots(
+        service.tfidf_matrix.data,
+        service.tfidf_matrix.indices,
+        service.tfidf_matrix.indptr,
+        query_vector.toarray().ravel()
+    )
+    expected = cosine_similarity(query_vector, service.tfidf_matrix).flatten()
+    assert scores == pytest.approx(expected)
+
+def test_similarity_top_k_indices_match_full_sort():
+    """Test the argpartition top-k returns the same ranking as a full sort."""
+    from app.services.similarity import _top_k_indices
+    
+    scores = np.random.default_rng(0).random(1000)
+    assert list(_top_k_indices(scores, 5)) == list(np.argsort(scores)[::-1][:5])
+    assert list(_top_k_indices(scores, 2000)) == list(np.argsort(scores)[::-1])
+    assert len(_top_k_indices(scores, 0)) == 0
+
+def test_similarity_query_vector_matches_vectorizer_transform():
+    """Test the cached-vocabulary query vector equals the fitted vectorizer's transform."""
+    service = SimilarityService()
+    service.build_index(SIMILARITY_REVIEWS)
+    
+    for query in ["cold food and a rude rude waiter", "good value", "nothing in vocabulary", ""]:
+        expected = service.vectorizer.transform([query])
+        assert service._vectorize_query(query).toarray() == pytest.approx(expected.toarray())
+
+def test_similarity_index_save_and_reload(tmp_path):
+    """Test a saved index is reloaded, extended with newer reviews, and rejected when stale."""
+    saved = SimilarityService()
+    saved.build_index(SIMILARITY_REVIEWS[:4])
+    saved.save_index(str(tmp_path))
+    
+    service = SimilarityService()
+    assert service._load_saved_index(SIMILARITY_REVIEWS, str(tmp_path))
+    assert service.tfidf_matrix.shape[0] == len(SIMILARITY_REVIEWS)
+    appended = saved.vectorizer.transform([SIMILARITY_REVIEWS[5]["review_text"]])
+    assert service.tfidf_matrix[5].toarray() == pytest.approx(appended.toarray())
+    assert service.find_similar("cold food", k=1)[0][0] in (1, 3)
+    
+    # A different review at the saved position means the saved index is stale
+    changed = SIMILARITY_REVIEWS[:3] + [{"id": 99, "review_text": "edited"}]
+    assert not SimilarityService()._load_saved_index(changed, str(tmp_path))
+    
+    # A failed load leaves an already built index in place
+    (tmp_path / "tfidf.npz").write_bytes(b"corrupt")
+    version = service.version
+    assert not service._load_saved_index(SIMILARITY_REVIEWS, str(tmp_path))
+    assert service.version == version and service.tfidf_matrix.shape[0] == len(SIMILARITY_REVIEWS)
+
+def test_similarity_ann_graph_saved_and_reloaded(tmp_path):
+    """Test a saved HNSW graph is loaded and extended instead of being rebuilt."""
+    pytest.importorskip("hnswlib")
+    saved = SimilarityService()
+    saved.ann_enabled = True
+    saved.ann_min_reviews = 1
+    saved.build_index(SIMILARITY_REVIEWS[:4])
+    thread = saved._ann_thread
+    if thread is not None:
+        thread.join()
+    saved.save_index(str(tmp_path))
+    
+    service = SimilarityService()
+    service.ann_enabled = True
+    service.ann_min_reviews = 1
+    assert service._load_saved_index(SIMILARITY_REVIEWS, str(tmp_path))
+    assert service._ann_thread is None
+    assert service.ann_index.get_current_count() == len(SIMILARITY_REVIEWS)
+
+def test_topics_column_tolerates_invalid_json():
+    """Test malformed stored topics decode to an empty list instead of failing the read."""
+    from app.models import JSONList
+    
+    column_type = JSONList()
+    assert column_type.process_result_value('["service", "price"]', None) == ["service", "price"]
+    assert column_type.process_result_value("not json", None) == []
+    assert column_type.process_result_value(None, None) == []
+
+def test_reviews_text_search(monkeypatch):
+    """Test /reviews?search= matching, including the FTS index staying in sync with edits."""
+    from app.database import SessionLocal
+    from app.models import Review as ReviewModel
+    from app.routes import reviews as reviews_routes
+    
+    marker = uuid.uuid4().hex[:12]
+    location = f"Search Test {marker}"
+    review = {
+        "business_name": f"Cafe {marker}",
+        "location": location,
+        "customer_name": "Ann Lee",
+        "rating": 4,
+        "review_text": 'Try the "Midnight" PANCAKES, ok?',
+        "date": "2024-01-15"
+    }
+    
+    def search_total(term):
+        response = started_client.get("/reviews", params={"search": term, "location": location})
+        assert response.status_code == 200
+        return response.json()["total"]
+    
+    with TestClient(app) as started_client:
+        assert started_client.post("/ingest", json=[review]).status_code == 200
+        
+        # 3+ characters, case-insensitive substring match
+        assert search_total("pancake") == 1
+        assert search_total("PANCAKE") == 1
+        assert search_total(marker.upper()) == 1
+        assert search_total("waffle") == 0
+        # Shorter than a trigram
+        assert search_total("ok") == 1
+        assert search_total("zz") == 0
+        # Quotes are matched literally
+        assert search_total('"Midnight"') == 1
+        assert search_total('"Midnight" waffles') == 0
+        
+        # SQLite builds without FTS5 trigram support scan with ILIKE instead
+        with monkeypatch.context() as patch:
+            patch.setattr(reviews_routes, "FTS_AVAILABLE", False)
+            assert search_total("pancake") == 1
+            assert search_total("waffle") == 0
+        
+        db = SessionLocal()
+        try:
+            db_review = db.query(ReviewModel).filter(ReviewModel.location == location).one()
+            db_review.review_text = "Waffles were soggy"
+            db.commit()
+            assert search_total("pancake") == 0
+            assert search_total("waffle") == 1
+            
+            db.delete(db_review)
+            db.commit()
+            assert search_total("waffle") == 0
+        finally:
+            db.close()
+
+def test_analyze_sentiments_batches_and_keeps_order():
+    """Test batched sentiment runs one sorted model call and restores input order."""
+    from app.services.ai import AIService
+    
+    calls = []
+    def fake_pipeline(texts, **kwargs):
+        calls.append((list(texts), kwargs))
+        return [
+            {"label": "negative" if "bad" in text else "positive", "score": 0.9}
+            for text in texts
+        ]
+    
+    service = AIService()
+    service.sentiment_analyzer = fake_pipeline
+    service.neutral_threshold = None
+    texts = ["A rather long and really good review", "bad", "Good food"]
+    
+    assert service.analyze_sentiments(texts, batch_size=8) == [
+        ("positive", 0.9), ("negative", -0.9), ("positive", 0.9)
+    ]
+    assert len(calls) == 1
+    assert calls[0][0] == ["bad", "Good food", "A rather long and really good review"]
+    assert calls[0][1]["batch_size"] == 8
+    
+    # Repeated texts are served from the cache; only the new one reaches the model
+    assert service.analyze_sentiments(["bad", "Good food", "bad again"]) == [
+        ("negative", -0.9), ("positive", 0.9), ("negative", -0.9)
+    ]
+    assert calls[1][0] == ["bad again"]
+    assert service.analyze_sentiment("Good food") == ("positive", 0.9)
+    assert len(calls) == 2
+    
+    # Blank texts are neutral and never reach the model
+    assert service.analyze_sentiments(["  ", "bad"]) == [("neutral", 0.0), ("negative", -0.9)]
+    assert service.analyze_sentiment("") == ("neutral", 0.0)
+    assert len(calls) == 2
+
+def test_generate_ai_reply_retries_rate_limits(monkeypatch):
+    """Test Perplexity 429/503 responses are retried and a 200 after them is used."""
+    import asyncio
+    import httpx
+    from app.services import ai
+    
+    monkeypatch.setattr(ai, "REPLY_RETRY_INITIAL_WAIT", 0)
+    statuses = [429, 503, 200]
+    def handler(request):
+        status = statuses.pop(0)
+        if status != 200:
+            return httpx.Response(status, headers={"Retry-After": "0"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": " Thank you! "}}]})
+    
+    service = ai.AIService()
+    service.perplexity_api_key = "test-key"
+    service._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    
+    assert asyncio.run(service.generate_ai_reply("Great food", "grateful", 5)) == "Thank you!"
+    assert statuses == []
+
+def test_ai_service_http_client_recreated_after_close():
+    """Test the pooled reply client is recreated after shutdown closes it."""
+    import asyncio
+    from app.services.ai import AIService
+    
+    service = AIService()
+    first = service._get_http_client()
+    asyncio.run(service.close())
+    assert first.is_closed
+    
+    second = service._get_http_client()
+    assert second is not first and not second.is_closed
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file